@@ -5,8 +5,7 @@ Creates index template, ILM policy, and initial index
 """
 
 from elasticsearch import Elasticsearch
-import requests
-import json
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration - ADJUST THESE
 ES_HOST = "http://localhost:9200"
@@ -17,7 +16,7 @@ TEMPLATE_NAME = f"lab{LAB_NUMBER}-wallapop-template"
 
 
 def create_ilm_policy(es: Elasticsearch):
-    """Create Index Lifecycle Management policy using direct HTTP"""
+    """Create Index Lifecycle Management policy"""
     policy = {
         "policy": {
             "phases": {
@@ -40,13 +39,8 @@ def create_ilm_policy(es: Elasticsearch):
     }
     
     try:
-        url = f"{ES_HOST}/_ilm/policy/{ILM_POLICY_NAME}"
-        response = requests.put(url, json=policy, headers={"Content-Type": "application/json"})
-        
-        if response.status_code in [200, 201]:
-            print(f"✓ Created ILM policy: {ILM_POLICY_NAME}")
-        else:
-            print(f"⚠ ILM policy creation: {response.status_code} - {response.text}")
+        es.ilm.put_lifecycle(name=ILM_POLICY_NAME, body=policy)
+        print(f"✓ Created ILM policy: {ILM_POLICY_NAME}")
     except Exception as e:
         print(f"⚠ ILM policy creation: {e}")
 
@@ -172,12 +166,13 @@ def main():
         print(f"✗ Could not connect to Elasticsearch: {e}")
         return
     
-    # Create components
-    print("Creating ILM policy...")
-    create_ilm_policy(es)
-    
-    print("\nCreating index template...")
-    create_index_template(es)
+    # Create components. The template only names the ILM policy, so both
+    # can be created at once; the initial index must wait for the template
+    # so it picks up the mappings and lifecycle settings.
+    print("Creating ILM policy and index template...")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda create: create(es),
+                          [create_ilm_policy, create_index_template]))
     
     print("\nCreating initial index...")
     create_initial_index(es)
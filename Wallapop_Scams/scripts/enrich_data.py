@@ -4,13 +4,35 @@ Data Enrichment Script
 Adds fraud detection features to collected Wallapop data
 """
 
+import gzip
 import json
 import os
 import re
-from typing import Dict, List, Tuple
-from statistics import median, mean
+from collections import Counter
+from contextlib import ExitStack
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 
+import ahocorasick
+import numpy as np
+import orjson
+
+# Flush enriched output to disk in ~1 MB blocks
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Files with at least this many items are enriched across all CPU cores
+PARALLEL_MIN_ITEMS = 5000
+POOL_CHUNK_SIZE = 512
+
+# Price risk tiers: (max ratio to median, points, risk factor), lowest first
+PRICE_RISK_TIERS = [
+    (0.3, 40, "extremely_low_price"),
+    (0.5, 30, "very_low_price"),
+    (0.7, 15, "low_price"),
+]
+PRICE_RISK_FACTORS = {points: factor for _, points, factor in PRICE_RISK_TIERS}
+
 
 class MotorbikeEnricher:
     """Enriches motorbike listings with fraud detection features"""
@@ -26,6 +48,26 @@ class MotorbikeEnricher:
         
         self.all_keywords_data = keywords_data
         
+        # Lowercased keyword set per category for O(1) membership checks
+        self._cat_sets = {
+            category: frozenset(kw.lower() for kw in keywords)
+            for category, keywords in keywords_data.items()
+        }
+        
+        # Deduplicated, pre-lowercased keywords (longest first), with the
+        # original-case form kept for display; first listing wins
+        self._kw_display: Dict[str, str] = {}
+        for keyword in self.suspicious_keywords:
+            self._kw_display.setdefault(keyword.lower(), keyword)
+        self.suspicious_keywords_lc = sorted(self._kw_display, key=len, reverse=True)
+        
+        # Compile all keywords into a single Aho-Corasick automaton so each
+        # text is scanned once regardless of how many keywords there are
+        self.ac = ahocorasick.Automaton()
+        for keyword_lc in self.suspicious_keywords_lc:
+            self.ac.add_word(keyword_lc, self._kw_display[keyword_lc])
+        self.ac.make_automaton()
+        
     def extract_price(self, item: Dict) -> float:
         """Extract price from item"""
         if "price" in item:
@@ -34,6 +76,10 @@ class MotorbikeEnricher:
             return float(item["price"])
         return 0.0
     
+    def _seller_id(self, item: Dict) -> str:
+        """Resolve seller ID across API field spellings"""
+        return item.get("user_id") or item.get("userid") or "unknown"
+    
     def detect_suspicious_keywords(self, text: str) -> List[str]:
         """
         Detect suspicious keywords in text
@@ -44,88 +90,125 @@ class MotorbikeEnricher:
         Returns:
             List of matched suspicious keywords
         """
-        text_lower = text.lower()
-        found_keywords = []
-        
-        for keyword in self.suspicious_keywords:
-            if keyword.lower() in text_lower:
-                found_keywords.append(keyword)
-        
-        return found_keywords
+        # dict.fromkeys keeps first-match order while dropping repeats
+        matches = self.ac.iter(text.lower())
+        return list(dict.fromkeys(keyword for _, keyword in matches))
     
-    def calculate_price_features(self, items: List[Dict]) -> Dict:
+    def summarize_prices(self, prices: np.ndarray) -> Dict:
         """
-        Calculate price statistics for the dataset
+        Calculate price statistics from an array of raw prices
         
         Returns:
-            Dictionary with price statistics
+            Dictionary with price statistics (non-positive prices ignored)
         """
-        prices = [self.extract_price(item) for item in items]
-        prices = [p for p in prices if p > 0]
+        prices = prices[prices > 0]
         
-        if not prices:
+        if not prices.size:
             return {"median": 0, "mean": 0, "min": 0, "max": 0}
         
         return {
-            "median": median(prices),
-            "mean": mean(prices),
-            "min": min(prices),
-            "max": max(prices)
+            "median": float(np.median(prices)),
+            "mean": float(prices.mean()),
+            "min": float(prices.min()),
+            "max": float(prices.max())
         }
     
-    def count_seller_items(self, items: List[Dict]) -> Dict[str, int]:
-        """Count items per seller"""
-        seller_counts = {}
+    def format_timestamps(self, values: List) -> List[Optional[str]]:
+        """
+        Convert raw timestamps to ISO 8601 strings in one vectorized pass
         
-        for item in items:
-            seller_id = item.get("user_id") or item.get("userid") or "unknown"
-            seller_counts[seller_id] = seller_counts.get(seller_id, 0) + 1
+        Numeric values (seconds or milliseconds since epoch) are formatted
+        together with NumPy; strings pass through and empty values become None.
         
-        return seller_counts
+        Returns:
+            List of ISO strings aligned with values
+        """
+        result = [ts or None for ts in values]
+        numeric_idx = [i for i, ts in enumerate(values)
+                       if ts and isinstance(ts, (int, float))]
+        
+        if numeric_idx:
+            raw = np.array([values[i] for i in numeric_idx], dtype=np.float64)
+            # Values above 1e12 are milliseconds since epoch, the rest seconds
+            secs = np.where(raw > 1000000000000, raw / 1000, raw)
+            # Round only the fractional part to microseconds, as
+            # datetime.utcfromtimestamp does, so float inputs match it exactly
+            whole = np.trunc(secs)
+            micros = (whole.astype(np.int64) * 1000000
+                      + np.rint((secs - whole) * 1e6).astype(np.int64))
+            iso = np.datetime_as_string(micros.astype('datetime64[us]'),
+                                        unit='us', timezone='UTC')
+            # Match datetime.isoformat(), which omits a zero fraction
+            iso = np.char.replace(iso, '.000000Z', 'Z')
+            for i, ts in zip(numeric_idx, iso.tolist()):
+                result[i] = ts
+        
+        return result
+    
+    def score_prices(self, prices: np.ndarray, median_price: float) -> np.ndarray:
+        """
+        Compute the price component of the risk score for all items at once
+        
+        Returns:
+            Integer array of price points (0 when no tier applies)
+        """
+        if median_price <= 0:
+            return np.zeros(len(prices), dtype=np.int32)
+        
+        ratios = prices / median_price
+        return np.select(
+            [ratios < max_ratio for max_ratio, _, _ in PRICE_RISK_TIERS],
+            [points for _, points, _ in PRICE_RISK_TIERS],
+            default=0
+        ).astype(np.int32)
+    
+    def _price_score(self, price: float, median_price: float) -> int:
+        """Price component of the risk score for a single item"""
+        if median_price > 0:
+            price_ratio = price / median_price
+            for max_ratio, points, _ in PRICE_RISK_TIERS:
+                if price_ratio < max_ratio:
+                    return points
+        return 0
     
     def calculate_risk_score(self, item: Dict, enrichment: Dict, 
-                            price_stats: Dict, seller_counts: Dict) -> Tuple[int, List[str]]:
+                            seller_item_count: int, median_price: float,
+                            price_score: Optional[int] = None) -> Tuple[int, List[str]]:
         """
         Calculate risk score (0-100) based on multiple signals
         
+        Args:
+            seller_item_count: Items listed today by this item's seller
+            median_price: Dataset median price (0 if unknown)
+            price_score: Price points precomputed by score_prices, if any
+        
         Returns:
             Tuple of (risk_score, risk_factors)
         """
         score = 0
         risk_factors = []
-        
-        price = enrichment["price"]
+        cat_sets = self._cat_sets
         
         # 1. Price-based signals (max 40 points)
-        if price_stats["median"] > 0:
-            price_ratio = price / price_stats["median"]
-            
-            if price_ratio < 0.3:  # Extremely low price
-                score += 40
-                risk_factors.append("extremely_low_price")
-            elif price_ratio < 0.5:  # Very low price
-                score += 30
-                risk_factors.append("very_low_price")
-            elif price_ratio < 0.7:  # Low price
-                score += 15
-                risk_factors.append("low_price")
+        if price_score is None:
+            price_score = self._price_score(enrichment["price"], median_price)
+        
+        if price_score:
+            score += price_score
+            risk_factors.append(PRICE_RISK_FACTORS[price_score])
         
         # 2. Suspicious keywords (max 30 points)
         suspicious_kw = enrichment.get("suspicious_keywords", [])
+        sus_lc = {kw.lower() for kw in suspicious_kw}
         
-        if any(kw in self.all_keywords_data["motorbike_specific"] 
-               for kw in suspicious_kw):
+        if sus_lc & cat_sets["motorbike_specific"]:
             score += 25
             risk_factors.append("motorbike_fraud_keywords")
-        elif any(kw in self.all_keywords_data["general_fraud"] 
-                 for kw in suspicious_kw):
+        elif sus_lc & cat_sets["general_fraud"]:
             score += 15
             risk_factors.append("general_fraud_keywords")
         
         # 3. Seller behavior (max 20 points)
-        seller_id = item.get("user_id") or item.get("userid") or "unknown"
-        seller_item_count = seller_counts.get(seller_id, 0)
-        
         if seller_item_count > 10:
             score += 20
             risk_factors.append("high_volume_seller")
@@ -145,10 +228,17 @@ class MotorbikeEnricher:
         return score, risk_factors
     
     def enrich_item(self, item: Dict, price_stats: Dict, 
-                   seller_counts: Dict) -> Dict:
+                   seller_counts: Dict,
+                   timestamps: Optional[Tuple[Optional[str], Optional[str]]] = None,
+                   price_score: Optional[int] = None) -> Dict:
         """
         Add enrichment fields to a single item
         
+        Args:
+            timestamps: Optional (created_at, modified_at) ISO strings
+                already produced by format_timestamps
+            price_score: Optional price points already produced by score_prices
+        
         Returns:
             Enriched item dictionary
         """
@@ -157,6 +247,9 @@ class MotorbikeEnricher:
         title = item.get("title", "")
         description = item.get("description", "")
         price = self.extract_price(item)
+        seller_id = self._seller_id(item)
+        seller_item_count = seller_counts.get(seller_id, 0)
+        median_price = price_stats["median"]
         
         # Combine text for keyword analysis
         full_text = f"{title} {description}"
@@ -169,21 +262,20 @@ class MotorbikeEnricher:
             "price": price,
             "suspicious_keywords": suspicious_kw,
             "has_suspicious_keywords": len(suspicious_kw) > 0,
-            "relative_price_index": (price / price_stats["median"] 
-                                    if price_stats["median"] > 0 else 0)
+            "relative_price_index": (price / median_price
+                                    if median_price > 0 else 0)
         }
         
         # Calculate risk score
         risk_score, risk_factors = self.calculate_risk_score(
-            item, enrichment, price_stats, seller_counts
+            item, enrichment, seller_item_count, median_price, price_score
         )
         
         enrichment["risk_score"] = risk_score
         enrichment["risk_factors"] = risk_factors
         
         # Add seller stats
-        seller_id = item.get("user_id") or item.get("userid") or "unknown"
-        enrichment["seller_items_today"] = seller_counts.get(seller_id, 0)
+        enrichment["seller_items_today"] = seller_item_count
         
         # Normalize item structure for Elasticsearch
         normalized_item = {
@@ -200,7 +292,7 @@ class MotorbikeEnricher:
             "location": self._normalize_location(item),
             
             # Timestamps
-            "timestamps": self._normalize_timestamps(item),
+            "timestamps": self._normalize_timestamps(item, timestamps),
             
             # Taxonomy
             "taxonomy": item.get("taxonomy", []),
@@ -233,11 +325,21 @@ class MotorbikeEnricher:
         
         return result
     
-    def _normalize_timestamps(self, item: Dict) -> Dict:
+    def _normalize_timestamps(self, item: Dict,
+                              preformatted: Optional[Tuple] = None) -> Dict:
         """Normalize timestamp fields"""
+        crawl_ts = item.get("crawl_timestamp")
+        
+        if preformatted is not None:
+            created_at, modified_at = preformatted
+            return {
+                "created_at": created_at,
+                "modified_at": modified_at,
+                "crawl_timestamp": crawl_ts or datetime.utcnow().isoformat() + 'Z'
+            }
+        
         created_at = item.get("created_at") or item.get("createdat")
         modified_at = item.get("modified_at") or item.get("modifiedat")
-        crawl_ts = item.get("crawl_timestamp")
         
         def normalize_timestamp(ts):
             """Convert timestamp to ISO format"""
@@ -259,6 +361,15 @@ class MotorbikeEnricher:
             "crawl_timestamp": crawl_ts or datetime.utcnow().isoformat() + 'Z'
         }
     
+    def _iter_items(self, path: str) -> Iterator[Dict]:
+        """Yield items from a JSON lines file (optionally gzipped) one at a time"""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield orjson.loads(line)
+    
     def enrich_file(self, input_file: str, output_file: str):
         """
         Enrich an entire daily file
@@ -269,47 +380,99 @@ class MotorbikeEnricher:
         """
         print(f"📖 Reading {input_file}...")
         
-        # Load all items
-        items = []
-        with open(input_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    items.append(json.loads(line))
+        # Pass 1: stream items, keeping only what the global stats need
+        prices = []
+        created_raw = []
+        modified_raw = []
+        seller_counts: Dict[str, int] = Counter()
+        for item in self._iter_items(input_file):
+            prices.append(self.extract_price(item))
+            created_raw.append(item.get("created_at") or item.get("createdat"))
+            modified_raw.append(item.get("modified_at") or item.get("modifiedat"))
+            seller_counts[self._seller_id(item)] += 1
         
-        print(f"✓ Loaded {len(items)} items")
+        print(f"✓ Loaded {len(prices)} items")
         
         # Calculate global statistics
         print("📊 Calculating statistics...")
-        price_stats = self.calculate_price_features(items)
-        seller_counts = self.count_seller_items(items)
+        prices = np.array(prices, dtype=np.float64)
+        price_stats = self.summarize_prices(prices)
         
         print(f"   Price median: €{price_stats['median']:.2f}")
         print(f"   Price range: €{price_stats['min']:.2f} - €{price_stats['max']:.2f}")
         print(f"   Unique sellers: {len(seller_counts)}")
         
-        # Enrich each item
-        print("🔧 Enriching items...")
-        enriched_items = []
-        for item in items:
-            enriched = self.enrich_item(item, price_stats, seller_counts)
-            enriched_items.append(enriched)
-        
-        # Save enriched data
-        print(f"💾 Saving to {output_file}...")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for item in enriched_items:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
-        
-        # Print statistics
-        high_risk_count = sum(1 for item in enriched_items 
-                             if item["enrichment"]["risk_score"] >= 60)
+        # Format all timestamps and score all prices at once instead of per item
+        created_iso = self.format_timestamps(created_raw)
+        modified_iso = self.format_timestamps(modified_raw)
+        price_scores = self.score_prices(prices, price_stats["median"]).tolist()
+        
+        # Pass 2: stream items again, enriching and saving one at a time
+        print(f"🔧 Enriching items and saving to {output_file}...")
+        high_risk_count = 0
+        buf = bytearray()
+        rows = zip(self._iter_items(input_file),
+                   zip(created_iso, modified_iso), price_scores)
+        initargs = (self, price_stats, seller_counts)
+        
+        with ExitStack() as stack:
+            f = stack.enter_context(open(output_file, 'wb'))
+            
+            # Items are independent once global stats are known, so large
+            # files are fanned out to worker processes (output order kept)
+            if len(prices) >= PARALLEL_MIN_ITEMS and (os.cpu_count() or 1) > 1:
+                pool = stack.enter_context(
+                    Pool(initializer=_init_worker, initargs=initargs)
+                )
+                results = pool.imap(_enrich_line, rows, chunksize=POOL_CHUNK_SIZE)
+            else:
+                _init_worker(*initargs)
+                results = map(_enrich_line, rows)
+            
+            for line, risk_score in results:
+                if risk_score >= 60:
+                    high_risk_count += 1
+                
+                buf += line
+                if len(buf) >= WRITE_BUFFER_SIZE:
+                    f.write(buf)
+                    buf.clear()
+            
+            f.write(buf)
         
         print(f"\n✓ Enrichment complete!")
         print(f"   High-risk items (score ≥ 60): {high_risk_count}")
         print(f"   Saved to: {output_file}")
 
 
+# Per-process enrichment context, filled in by _init_worker
+_worker_state = {}
+
+
+def _init_worker(enricher: MotorbikeEnricher, price_stats: Dict,
+                 seller_counts: Dict):
+    """Store the shared enrichment context in the current process"""
+    _worker_state["enricher"] = enricher
+    _worker_state["price_stats"] = price_stats
+    _worker_state["seller_counts"] = seller_counts
+
+
+def _enrich_line(row: Tuple[Dict, Tuple, int]) -> Tuple[bytes, int]:
+    """
+    Enrich one (item, timestamps, price_score) row
+    
+    Returns:
+        Tuple of (encoded JSON line, risk_score)
+    """
+    item, timestamps, price_score = row
+    enriched = _worker_state["enricher"].enrich_item(
+        item, _worker_state["price_stats"], _worker_state["seller_counts"],
+        timestamps, price_score
+    )
+    line = orjson.dumps(enriched, option=orjson.OPT_APPEND_NEWLINE)
+    return line, enriched["enrichment"]["risk_score"]
+
+
 def main():
     """Main execution"""
     import sys
@@ -326,7 +489,8 @@ def main():
     if len(sys.argv) >= 3:
         output_file = sys.argv[2]
     else:
-        base = os.path.splitext(input_file)[0]
+        base = input_file[:-3] if input_file.endswith(".gz") else input_file
+        base = os.path.splitext(base)[0]
         output_file = f"{base}_enriched.json"
     
     enricher = MotorbikeEnricher()
@@ -5,7 +5,9 @@ Loads enriched JSON data into Elasticsearch
 """
 
 from elasticsearch import Elasticsearch, helpers
-import json
+from elasticsearch.serializer import OrjsonSerializer
+import gzip
+import orjson
 import sys
 import os
 
@@ -13,18 +15,22 @@ import os
 ES_HOST = "http://localhost:9200"
 LAB_NUMBER = "001"  # Change to your lab number
 INDEX_ALIAS = f"lab{LAB_NUMBER}.wallapop"
+DEFAULT_THREAD_COUNT = 8
+MAX_RETRIES = 3  # per-document retries for 429 rejections
 
 
 def load_json_lines(filepath: str):
-    """Load JSON lines file"""
-    with open(filepath, 'r', encoding='utf-8') as f:
+    """Load JSON lines file (optionally gzipped)"""
+    opener = gzip.open if filepath.endswith(".gz") else open
+    with opener(filepath, 'rb') as f:
         for line in f:
             line = line.strip()
             if line:
-                yield json.loads(line)
+                yield orjson.loads(line)
 
 
-def bulk_ingest(es: Elasticsearch, filepath: str, batch_size: int = 500):
+def bulk_ingest(es: Elasticsearch, filepath: str, batch_size: int = 500,
+                thread_count: int = DEFAULT_THREAD_COUNT):
     """
     Bulk ingest data to Elasticsearch
     
@@ -32,10 +38,13 @@ def bulk_ingest(es: Elasticsearch, filepath: str, batch_size: int = 500):
         es: Elasticsearch client
         filepath: Path to JSON lines file
         batch_size: Number of documents per batch
+        thread_count: Number of bulk requests kept in flight concurrently
     """
-    def generate_actions():
-        """Generator for bulk API actions"""
+    def generate_actions(only_ids=None):
+        """Generator for bulk API actions, optionally limited to some ids"""
         for doc in load_json_lines(filepath):
+            if only_ids is not None and doc.get("id") not in only_ids:
+                continue
             yield {
                 "_index": INDEX_ALIAS,
                 "_id": doc.get("id"),
@@ -45,18 +54,14 @@ def bulk_ingest(es: Elasticsearch, filepath: str, batch_size: int = 500):
     print(f"📤 Starting bulk ingestion to {INDEX_ALIAS}...")
     
     try:
-        # Use helpers.bulk with better error reporting
+        # Keep several bulk requests in flight instead of waiting on each one
         success_count = 0
         error_count = 0
         errors = []
+        retry_ids = set()
         
-        for ok, result in helpers.streaming_bulk(
-            es,
-            generate_actions(),
-            chunk_size=batch_size,
-            raise_on_error=False,
-            max_retries=3
-        ):
+        def record(ok, result):
+            nonlocal success_count, error_count
             if ok:
                 success_count += 1
             else:
@@ -65,6 +70,40 @@ def bulk_ingest(es: Elasticsearch, filepath: str, batch_size: int = 500):
                 if len(errors) <= 5:  # Only print first 5 errors
                     print(f"\n⚠ Error: {result}")
         
+        for ok, result in helpers.parallel_bulk(
+            es,
+            generate_actions(),
+            thread_count=thread_count,
+            chunk_size=batch_size,
+            queue_size=thread_count,
+            raise_on_error=False
+        ):
+            # parallel_bulk cannot retry; set 429 rejections aside
+            item = next(iter(result.values()))
+            if not ok and item.get("status") == 429 and item.get("_id") is not None:
+                retry_ids.add(item["_id"])
+            else:
+                record(ok, result)
+        
+        if retry_ids:
+            # Re-read only the rejected documents and send them serially,
+            # backing off between attempts
+            print(f"\n↻ Retrying {len(retry_ids)} documents rejected with 429...")
+            retried = 0
+            for ok, result in helpers.streaming_bulk(
+                es,
+                generate_actions(only_ids=retry_ids),
+                chunk_size=batch_size,
+                max_retries=MAX_RETRIES,
+                initial_backoff=2,
+                raise_on_error=False
+            ):
+                retried += 1
+                record(ok, result)
+            # Rejected ids with no matching document id in the file
+            # (auto-generated _id) cannot be resent
+            error_count += max(len(retry_ids) - retried, 0)
+        
         print(f"\n✓ Ingestion complete!")
         print(f"   Successfully indexed: {success_count}")
         print(f"   Failed: {error_count}")
@@ -87,12 +126,19 @@ def bulk_ingest(es: Elasticsearch, filepath: str, batch_size: int = 500):
 def main():
     """Main execution"""
     if len(sys.argv) < 2:
-        print("Usage: python ingest_to_elastic.py <enriched_json_file>")
+        print("Usage: python ingest_to_elastic.py <enriched_json_file> [thread_count]")
         print("\nExample:")
         print("  python ingest_to_elastic.py data/wallapop_motorbikes_20251210_enriched.json")
         sys.exit(1)
     
     filepath = sys.argv[1]
+    thread_count = DEFAULT_THREAD_COUNT
+    if len(sys.argv) >= 3:
+        if not sys.argv[2].isdigit() or int(sys.argv[2]) < 1:
+            print(f"✗ Invalid thread count: {sys.argv[2]}")
+            print("Usage: python ingest_to_elastic.py <enriched_json_file> [thread_count]")
+            sys.exit(1)
+        thread_count = int(sys.argv[2])
     
     if not os.path.exists(filepath):
         print(f"✗ File not found: {filepath}")
@@ -102,11 +148,22 @@ def main():
     print("Elasticsearch Bulk Ingestion")
     print("=" * 60)
     print(f"\nFile: {filepath}")
-    print(f"Target index: {INDEX_ALIAS}\n")
+    print(f"Target index: {INDEX_ALIAS}")
+    print(f"Bulk threads: {thread_count}\n")
     
     # Connect to Elasticsearch
     try:
-        es = Elasticsearch([ES_HOST])
+        es = Elasticsearch(
+            [ES_HOST],
+            # The bulk helpers encode every action and _source with the
+            # application/json serializer (the compat mimetype inherits it);
+            # the NDJSON body then just joins those bytes
+            serializers={"application/json": OrjsonSerializer()},
+            http_compress=True,
+            request_timeout=60,
+            max_retries=MAX_RETRIES,
+            retry_on_status=(429, 502, 503, 504)
+        )
         es.info()
         print("✓ Connected to Elasticsearch\n")
     except Exception as e:
@@ -114,7 +171,7 @@ def main():
         sys.exit(1)
     
     # Ingest data
-    success, failed = bulk_ingest(es, filepath)
+    success, failed = bulk_ingest(es, filepath, thread_count=thread_count)
     
     print("\n" + "=" * 60)
 
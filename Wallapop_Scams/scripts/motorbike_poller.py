@@ -4,8 +4,10 @@ Wallapop Motorbike Poller
 Collects motorbike listings from Wallapop API and saves to daily JSON files
 """
 
-import requests
-import json
+import asyncio
+import httpx
+import gzip
+import orjson
 import os
 from datetime import datetime
 from typing import List, Dict, Optional
@@ -47,7 +49,61 @@ MOTORBIKE_KEYWORDS = [
     "moto"
 ]
 
+# Known locations of the item list in search responses, most likely first
+ITEM_PATHS = [
+    ("data", "section", "payload", "items"),
+    ("search_objects",),
+    ("data",),
+    ("items",),
+]
+
+# Concurrency and politeness limits
+MAX_CONCURRENT_REQUESTS = 4  # Requests in flight at once
+REQUESTS_PER_SECOND = 2  # Global ceiling shared by all requests
+
+# Retry policy for transient failures
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # Seconds, doubled on each attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 OUTPUT_DIR = "data"
+COMPRESS_OUTPUT = False  # Opt-in: write daily files as .json.gz
+
+
+def _get_path(data: Dict, path: tuple) -> Optional[List[Dict]]:
+    """Follow path through nested dicts, returning the list found there"""
+    node = data
+    for key in path:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node if isinstance(node, list) else None
+
+
+class RateLimiter:
+    """Token bucket shared by all concurrent requests"""
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a request slot is available"""
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.last = time.monotonic()
+            
+            self.tokens -= 1
 
 
 class WallapopPoller:
@@ -57,14 +113,56 @@ class WallapopPoller:
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
         
-    def fetch_items(self, keywords: Optional[str] = None, 
-                   max_retries: int = 3) -> List[Dict]:
+        # One HTTP/2 client multiplexes every search and detail request
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers=HEADERS,
+            timeout=30,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS)
+        )
+        
+        self.rate_limiter = RateLimiter(REQUESTS_PER_SECOND)
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        
+        # Response shape detected on the first successful search
+        self._items_path = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+    
+    async def _get(self, url: str, params: Optional[Dict] = None,
+                   timeout: float = 30) -> httpx.Response:
+        """
+        Rate-limited GET with exponential backoff on transient failures
+        
+        Raises:
+            httpx.HTTPError: If the request still fails after MAX_RETRIES
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            await self.rate_limiter.acquire()
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(url, params=params,
+                                                     timeout=timeout)
+                if (response.status_code not in RETRY_STATUSES
+                        or attempt == MAX_RETRIES):
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError:
+                if attempt == MAX_RETRIES:
+                    raise
+            
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    
+    async def fetch_items(self, keywords: Optional[str] = None) -> List[Dict]:
         """
         Fetch items from Wallapop API
         
         Args:
             keywords: Optional search keywords
-            max_retries: Number of retry attempts
             
         Returns:
             List of item dictionaries
@@ -74,49 +172,43 @@ class WallapopPoller:
         if keywords:
             params["keywords"] = keywords
             
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(
-                    API_URL,
-                    params=params,
-                    headers=HEADERS,
-                    timeout=30
-                )
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                # Extract items from response (adjust path based on actual structure)
-                # Common paths: data.section.payload.items or search_objects
-                items = []
-                
-                # Try different possible response structures
-                if "data" in data and "section" in data["data"]:
-                    items = data["data"]["section"].get("payload", {}).get("items", [])
-                elif "search_objects" in data:
-                    items = data["search_objects"]
-                elif "data" in data:
-                    items = data.get("data", [])
-                else:
-                    items = data.get("items", [])
-                
-                print(f"✓ Fetched {len(items)} items for keywords: {keywords or 'all'}")
+        try:
+            response = await self._get(API_URL, params=params, timeout=30)
+            items = self._extract_items(response.json())
+            
+            print(f"✓ Fetched {len(items)} items for keywords: {keywords or 'all'}")
+            return items
+            
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"✗ Failed to fetch items for keywords {keywords or 'all'}: {e}")
+            return []
+    
+    def _extract_items(self, data: Dict) -> List[Dict]:
+        """
+        Extract the item list from a search response
+        
+        The first matching path in ITEM_PATHS is remembered, so later
+        responses are read directly without probing the other shapes.
+        """
+        if self._items_path is not None:
+            items = _get_path(data, self._items_path)
+            if items is not None:
                 return items
-                
-            except requests.exceptions.RequestException as e:
-                print(f"⚠ Attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-                else:
-                    print(f"✗ Failed to fetch items after {max_retries} attempts")
-                    return []
-                    
+        
+        for path in ITEM_PATHS:
+            items = _get_path(data, path)
+            if items is not None:
+                self._items_path = path
+                return items
+        
         return []
     
-    def fetch_item_details(self, item_id: str) -> Optional[Dict]:
+    async def fetch_item_details(self, item_id: str) -> Optional[Dict]:
         """
         Fetch detailed information for a specific item
         
+        Several IDs can be fetched concurrently with asyncio.gather.
+        
         Args:
             item_id: Wallapop item ID
             
@@ -125,14 +217,13 @@ class WallapopPoller:
         """
         try:
             url = f"https://api.wallapop.com/api/v3/items/{item_id}"
-            response = requests.get(url, headers=HEADERS, timeout=10)
-            response.raise_for_status()
+            response = await self._get(url, timeout=10)
             return response.json()
         except Exception as e:
             print(f"⚠ Could not fetch details for item {item_id}: {e}")
             return None
     
-    def collect_all_items(self, use_keywords: bool = True) -> List[Dict]:
+    async def collect_all_items(self, use_keywords: bool = True) -> List[Dict]:
         """
         Collect all motorbike items, optionally using multiple keyword searches
         
@@ -146,27 +237,29 @@ class WallapopPoller:
         seen_ids = set()
         
         if use_keywords:
-            for keyword in MOTORBIKE_KEYWORDS:
-                items = self.fetch_items(keywords=keyword)
-                
-                # Deduplicate items
+            # Searches run concurrently; the rate limiter keeps the API happy
+            results = await asyncio.gather(
+                *(self.fetch_items(keywords=kw) for kw in MOTORBIKE_KEYWORDS)
+            )
+            
+            # Deduplicate items (in keyword order)
+            for items in results:
                 for item in items:
                     item_id = item.get("id")
                     if item_id and item_id not in seen_ids:
                         all_items.append(item)
                         seen_ids.add(item_id)
-                
-                time.sleep(1)  # Be respectful to the API
         else:
             # Single search without keywords
-            all_items = self.fetch_items()
+            all_items = await self.fetch_items()
         
         print(f"\n✓ Total unique items collected: {len(all_items)}")
         return all_items
     
     def save_daily_file(self, items: List[Dict]) -> str:
         """
-        Save items to a daily JSON file (one JSON object per line)
+        Save items to a daily JSON file (one JSON object per line),
+        gzip-compressed when COMPRESS_OUTPUT is enabled
         
         Args:
             items: List of item dictionaries
@@ -177,16 +270,32 @@ class WallapopPoller:
         today = datetime.utcnow().strftime("%Y%m%d")
         filename = os.path.join(self.output_dir, f"wallapop_motorbikes_{today}.json")
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            for item in items:
-                # Add collection timestamp
-                item['crawl_timestamp'] = datetime.utcnow().isoformat() + 'Z'
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        if COMPRESS_OUTPUT:
+            filename += ".gz"
+            opener = gzip.open
+        else:
+            opener = open
+        
+        # All items in a run share the same collection timestamp
+        crawl_timestamp = datetime.utcnow().isoformat() + 'Z'
+        lines = []
+        for item in items:
+            item['crawl_timestamp'] = crawl_timestamp
+            lines.append(orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE))
+        
+        with opener(filename, 'wb') as f:
+            f.writelines(lines)
         
         print(f"✓ Saved {len(items)} items to {filename}")
         return filename
 
 
+async def collect(poller: WallapopPoller) -> List[Dict]:
+    """Run the keyword searches and close the HTTP client afterwards"""
+    async with poller:
+        return await poller.collect_all_items(use_keywords=True)
+
+
 def main():
     """Main execution function"""
     print("=" * 60)
@@ -197,7 +306,7 @@ def main():
     
     # Collect items
     print("\n🔍 Collecting motorbike listings...")
-    items = poller.collect_all_items(use_keywords=True)
+    items = asyncio.run(collect(poller))
     
     if items:
         # Save to daily file
@@ -4,13 +4,23 @@ Wallapop Motorbike Fraud Detection Agent
 All-in-one: Poll → Enrich → Ingest to Elasticsearch
 """
 
+import ahocorasick
+import aiohttp
+import asyncio
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import os
+import re
+import time
+import numpy as np
+from collections import Counter
+from dataclasses import dataclass
+from multiprocessing import Pool
 from datetime import datetime, timezone
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional
 from statistics import mean
-import time
 import hashlib
 
 # ============================================================================
@@ -24,10 +34,20 @@ HEADERS = {
     "X-DeviceOS": "0"
 }
 
+# Collection concurrency
+MAX_CONCURRENT_REQUESTS = 6
+REQUESTS_PER_SECOND = 4  # shared by all keywords, replaces per-page sleeps
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+# Batches larger than this scan keywords in a process pool (multi-core only)
+PARALLEL_MIN_ITEMS = 5000
+POOL_CHUNK_SIZE = 512
+
 # Elasticsearch
 ES_HOST = os.environ.get("ES_HOST", "http://192.168.153.2:9200")
 LAB_NUMBER = "001"
 INDEX_ALIAS = f"lab{LAB_NUMBER}.wallapop"
+BATCH_SIZE = 1000  # documents per _bulk request
 
 # Search Config
 MOTORBIKE_CATEGORY_ID = "14000"
@@ -47,6 +67,9 @@ CLOTHING_KEYWORDS = [
     "alforja", "mochila", "chaleco", "protector", "cubremanos",
     "candado", "antirrobo", "baul", "maleta", "caballete"
 ]
+# One alternation searched by the C regex engine; stops at the first hit.
+# Matched against lowercased text, like the risk keywords
+CLOTHING_RE = re.compile("|".join(re.escape(kw) for kw in CLOTHING_KEYWORDS))
 
 # Risk keywords (categorized)
 RISK_KEYWORDS = {
@@ -56,21 +79,76 @@ RISK_KEYWORDS = {
     "GENERAL_URGENCY": ["urgente", "solo hoy", "rapido"],
     "GENERAL_PRICE": ["ganga", "chollo", "muy barato"]
 }
+CRITICAL_SET = frozenset({"CRITICAL_LEGAL", "CRITICAL_INTEGRITY", "CRITICAL_FRAUD"})
+GENERAL_SET = frozenset({"GENERAL_URGENCY", "GENERAL_PRICE"})
 
 # Paths
 OUTPUT_DIR = "data"
 BACKUP_ENABLED = True  # Save JSON backup to disk
+BACKUP_BUFFER_SIZE = 8 * 1024 * 1024  # 8 MiB write buffer for the backup file
 
 
 # ============================================================================
 # STEP 1: DATA COLLECTION (POLLING)
 # ============================================================================
 
+def _build_automaton(entries) -> ahocorasick.Automaton:
+    """Compile (keyword, value) pairs into an Aho-Corasick automaton"""
+    automaton = ahocorasick.Automaton()
+    for keyword, value in entries:
+        automaton.add_word(keyword, value)
+    automaton.make_automaton()
+    return automaton
+
+
+class TokenBucket:
+    """Async token bucket; acquire() waits until a request may be sent"""
+    
+    def __init__(self, rate_per_sec: float, capacity: Optional[float] = None):
+        self.rate = rate_per_sec
+        self.capacity = capacity if capacity is not None else rate_per_sec
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
 class WallapopCollector:
     """Handles data collection from Wallapop API"""
     
-    def fetch_all_pages(self, keywords: Optional[str] = None) -> List[Dict]:
-        """Fetch all pages with pagination"""
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_REQUESTS):
+        # Shared HTTP session, opened for the duration of collect_all()
+        self.session: Optional[aiohttp.ClientSession] = None
+        # Caps in-flight requests across all keyword tasks
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # Global request rate budget shared by all keyword tasks
+        self.bucket = TokenBucket(rate_per_sec=REQUESTS_PER_SECOND)
+    
+    async def fetch_all_pages(self, keywords: Optional[str] = None,
+                              seen_ids: Optional[set] = None) -> List[Dict]:
+        """
+        Fetch all pages with pagination, keeping only items not in seen_ids
+        
+        seen_ids is shared by all keyword tasks of a collection run, so
+        pagination stops as soon as a page holds nothing new.
+        """
+        if seen_ids is None:
+            seen_ids = set()
+        
         all_items = []
         offset = 0
         limit = 50
@@ -94,176 +172,282 @@ class WallapopCollector:
             params["offset"] = offset
             
             try:
-                response = requests.get(API_URL, params=params, headers=HEADERS, timeout=15)
-                response.raise_for_status()
+                await self.bucket.acquire()
+                async with self.semaphore:
+                    async with self.session.get(API_URL, params=params,
+                                                timeout=REQUEST_TIMEOUT) as response:
+                        response.raise_for_status()
+                        data = await response.json()
                 
-                data = response.json()
                 items = data.get("data", {}).get("section", {}).get("payload", {}).get("items", [])
                 
                 if not items:
                     break
                 
-                all_items.extend(items)
-                print(f"    Page {page}: +{len(items)} items")
+                new_items = []
+                for item in items:
+                    item_id = item.get("id")
+                    if item_id and item_id not in seen_ids:
+                        seen_ids.add(item_id)
+                        new_items.append(item)
+                
+                all_items.extend(new_items)
+                print(f"    [{keywords}] Page {page}: +{len(new_items)} new items")
+                
+                # Whole page already collected by another keyword
+                if not new_items:
+                    break
                 
                 if len(items) < limit:
                     break
                 
                 offset += limit
                 page += 1
-                time.sleep(0.5)
                 
             except Exception as e:
-                print(f"    ⚠ Page {page} error: {e}")
+                print(f"    ⚠ [{keywords}] Page {page} error: {e}")
                 break
         
         return all_items
     
-    def collect_all(self) -> List[Dict]:
-        """Collect from all keywords and deduplicate"""
-        all_items = []
+    async def collect_all(self) -> List[Dict]:
+        """Collect from all keywords concurrently and deduplicate"""
         seen_ids = set()
         
-        for keyword in MOTORBIKE_KEYWORDS:
-            print(f"\n  🔍 Keyword: '{keyword}'")
-            items = self.fetch_all_pages(keywords=keyword)
-            
-            for item in items:
-                item_id = item.get("id")
-                if item_id and item_id not in seen_ids:
-                    all_items.append(item)
-                    seen_ids.add(item_id)
+        print(f"\n  🔍 Keywords: {', '.join(MOTORBIKE_KEYWORDS)}")
+        # Keep-alive pool reused by every page request
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=16)
+        async with aiohttp.ClientSession(headers=HEADERS, connector=connector) as session:
+            self.session = session
+            results = await asyncio.gather(
+                *(self.fetch_all_pages(keywords=kw, seen_ids=seen_ids)
+                  for kw in MOTORBIKE_KEYWORDS)
+            )
+        self.session = None
+        
+        all_items = [item for items in results for item in items]
         
         print(f"\n  ✓ Total unique items: {len(all_items)}")
         return all_items
-    
-    def filter_clothing(self, items: List[Dict]) -> tuple:
-        """Remove clothing and accessories"""
-        filtered = []
-        removed = 0
-        
-        for item in items:
-            text = f"{item.get('title', '')} {item.get('description', '')}".lower()
-            if not any(kw in text for kw in CLOTHING_KEYWORDS):
-                filtered.append(item)
-            else:
-                removed += 1
-        
-        return filtered, removed
 
 
 # ============================================================================
 # STEP 2: DATA ENRICHMENT
 # ============================================================================
 
+def _to_iso_ms(ts) -> str:
+    """Numeric epoch (ms or s) to ISO 8601 UTC with a Z suffix"""
+    if ts > 10000000000:
+        ts = ts / 1000
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _to_iso_any(ts) -> Optional[str]:
+    """Timestamp of any API shape to ISO 8601; strings pass through"""
+    if not ts:
+        return None
+    # Wallapop sends epoch ms, so check exact numeric types first
+    cls = type(ts)
+    if cls is int or cls is float:
+        return _to_iso_ms(ts)
+    if cls is str:
+        return ts
+    if isinstance(ts, (int, float)):
+        return _to_iso_ms(ts)
+    return None
+
+
+class PreparedItem(NamedTuple):
+    """A kept item with the fields enrichment reads and its keyword matches"""
+    item: Dict
+    price: float
+    seller_id: Optional[str]
+    title: str
+    description: str
+    keywords: List[str]
+    categories: set
+
+
+class PreparedBatch(NamedTuple):
+    """Kept items with their per-item fields and batch-wide statistics"""
+    records: List[PreparedItem]
+    prices: List[float]   # positive prices only
+    seller_counts: Counter
+
+
+@dataclass(slots=True)
+class Enriched:
+    """
+    Enriched item as indexed in Elasticsearch
+    
+    orjson serializes it directly, in field order.
+    """
+    id: Optional[str]
+    title: str
+    description: str
+    price: float
+    currency: str
+    seller_id: Optional[str]
+    category_id: Optional[str]
+    web_slug: Optional[str]
+    location: Dict
+    timestamps: Dict
+    taxonomy: List
+    enrichment: Dict
+
+
 class WallapopEnricher:
     """Enriches items with risk scores and metadata"""
     
-    def detect_suspicious_keywords(self, text: str) -> tuple:
-        """Returns (keywords_found, categories_triggered)"""
-        if not text:
-            return [], set()
-        
-        text_lower = text.lower()
-        found_keywords = []
-        found_categories = set()
-        
-        for category, keywords in RISK_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    found_keywords.append(keyword)
-                    found_categories.add(category)
+    def __init__(self):
+        # Single-pass matcher reporting (category, keyword) for every hit
+        self.ac = _build_automaton(
+            (keyword, (category, keyword))
+            for category, keywords in RISK_KEYWORDS.items()
+            for keyword in keywords
+        )
+    
+    def _match_keywords(self, text_lower: str) -> tuple:
+        """Returns (keywords_found, categories_triggered) for lowercased text"""
+        # keyword -> category, one entry per distinct keyword found
+        found = {}
+        for _, (category, keyword) in self.ac.iter(text_lower):
+            found[keyword] = category
         
-        return found_keywords, found_categories
+        return list(found), set(found.values())
     
-    def calculate_risk_score(self, item: Dict, prices: List[float], 
-                            seller_counts: Dict, found_categories: set) -> int:
-        """Calculate risk score 0-100"""
-        score = 0
-        price = item.get("price", {}).get("amount", 0)
+    def calculate_risk_scores(self, prices: np.ndarray, t40: float, t60: float,
+                              seller_counts: np.ndarray, desc_len: np.ndarray,
+                              has_critical: np.ndarray,
+                              has_general: np.ndarray) -> np.ndarray:
+        """
+        Calculate risk scores 0-100 for a whole batch at once
+        
+        Each argument array holds one entry per item. t40/t60 are 40% and
+        60% of the average price, precomputed once per batch by enrich_prepared
+        (both 0 when there are no prices).
+        """
+        score = np.zeros(len(prices), dtype=np.int32)
         
         # 1. Keyword-based risk (30 points)
-        if any(cat in found_categories for cat in ["CRITICAL_LEGAL", "CRITICAL_INTEGRITY", "CRITICAL_FRAUD"]):
-            score += 30
-        elif any(cat in found_categories for cat in ["GENERAL_URGENCY", "GENERAL_PRICE"]):
-            score += 15
+        score += 30 * has_critical
+        score += 15 * (~has_critical & has_general)
         
         # 2. Price-based risk (40 points)
-        if prices:
-            avg_price = mean(prices)
-            if price and price < avg_price * 0.4:
-                score += 40
-            elif price and price < avg_price * 0.6:
-                score += 20
+        has_price = prices != 0
+        very_low = has_price & (prices < t40)
+        score += 40 * very_low
+        score += 20 * (has_price & ~very_low & (prices < t60))
         
         # 3. Seller behavior (20 points)
-        seller_id = item.get("user_id")
-        seller_count = seller_counts.get(seller_id, 0)
-        if seller_count > 10:
-            score += 20
-        elif seller_count > 5:
-            score += 10
+        score += 20 * (seller_counts > 10)
+        score += 10 * ((seller_counts > 5) & (seller_counts <= 10))
         
         # 4. Description quality (10 points)
-        description = item.get("description", "")
-        if len(description) < 50:
-            score += 10
+        score += 10 * (desc_len < 50)
         
-        return min(score, 100)
+        return np.minimum(score, 100)
     
-    def enrich_all(self, items: List[Dict]) -> List[Dict]:
-        """Enrich all items"""
-        # Calculate statistics
-        prices = [item.get("price", {}).get("amount") for item in items 
-                 if item.get("price", {}).get("amount")]
-        prices = [p for p in prices if p and p > 0]
+    def prepare_and_filter(self, items: List[Dict]) -> tuple:
+        """
+        Drop clothing/accessories and prepare the rest in a single pass
+        
+        Returns (batch, removed_count); pass batch to enrich_prepared().
+        """
+        rows = []
+        texts = []
+        prices = []
+        seller_counts = Counter()
+        removed = 0
         
-        seller_counts = {}
         for item in items:
+            title = item.get("title", "")
+            description = item.get("description", "")
+            
+            text_lower = f"{title} {description}".lower()
+            
+            if CLOTHING_RE.search(text_lower) is not None:
+                removed += 1
+                continue
+            
+            price = (item.get("price") or {}).get("amount") or 0
+            if price > 0:
+                prices.append(price)
             seller_id = item.get("user_id")
             if seller_id:
-                seller_counts[seller_id] = seller_counts.get(seller_id, 0) + 1
+                seller_counts[seller_id] += 1
+            
+            rows.append((item, price, seller_id, title, description))
+            texts.append(text_lower)
+        
+        # Keyword scanning is CPU-bound and independent per item
+        if len(texts) > PARALLEL_MIN_ITEMS and (os.cpu_count() or 1) > 1:
+            with Pool(initializer=_init_worker, initargs=(self,)) as pool:
+                matches = list(pool.imap(_scan_text, texts, chunksize=POOL_CHUNK_SIZE))
+        else:
+            matches = map(self._match_keywords, texts)
+        
+        records = [PreparedItem(*row, *match) for row, match in zip(rows, matches)]
+        
+        return PreparedBatch(records, prices, seller_counts), removed
+    
+    def enrich_prepared(self, batch: PreparedBatch) -> List[Enriched]:
+        """Enrich a batch built by prepare_and_filter()"""
+        records, prices, seller_counts = batch
+        
+        # Batch-wide price figures, computed once rather than per item
+        avg_price = mean(prices) if prices else 0.0
+        t40 = avg_price * 0.4
+        t60 = avg_price * 0.6
+        inv_avg = 1.0 / avg_price if avg_price > 0 else 0.0
+        crawl_ts = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+        
+        # Calculate risk for the whole batch from per-item feature arrays
+        n = len(records)
+        risk_scores = self.calculate_risk_scores(
+            np.fromiter((r.price for r in records), dtype=np.float64, count=n),
+            t40, t60,
+            np.fromiter((seller_counts.get(r.seller_id, 0) for r in records),
+                        dtype=np.int64, count=n),
+            np.fromiter((len(r.description) for r in records), dtype=np.int64, count=n),
+            np.fromiter((not CRITICAL_SET.isdisjoint(r.categories) for r in records),
+                        dtype=bool, count=n),
+            np.fromiter((not GENERAL_SET.isdisjoint(r.categories) for r in records),
+                        dtype=bool, count=n),
+        ).tolist()
         
         enriched_items = []
         
-        for item in items:
-            # Detect keywords
-            text = f"{item.get('title', '')} {item.get('description', '')}"
-            found_kw, found_cat = self.detect_suspicious_keywords(text)
-            
-            # Calculate risk
-            risk_score = self.calculate_risk_score(item, prices, seller_counts, found_cat)
-            
+        for (item, price, seller_id, title, description, found_kw, found_cat), risk_score \
+                in zip(records, risk_scores):
             # Calculate relative price
-            price = item.get("price", {}).get("amount", 0)
-            avg_price = mean(prices) if prices else 1
-            relative_price = round(price / avg_price, 2) if avg_price > 0 else 1.0
+            relative_price = round(price * inv_avg, 2)
             
             # Build enriched item
-            enriched = {
-                "id": item.get("id"),
-                "title": item.get("title", ""),
-                "description": item.get("description", ""),
-                "price": price,
-                "currency": item.get("currency", "EUR"),
-                "seller_id": item.get("user_id"),
-                "category_id": item.get("category_id"),
-                "web_slug": item.get("web_slug"),
+            enriched = Enriched(
+                id=item.get("id"),
+                title=title,
+                description=description,
+                price=price,
+                currency=item.get("currency", "EUR"),
+                seller_id=seller_id,
+                category_id=item.get("category_id"),
+                web_slug=item.get("web_slug"),
                 
-                "location": self._normalize_location(item),
-                "timestamps": self._normalize_timestamps(item),
-                "taxonomy": item.get("taxonomy", []),
+                location=self._normalize_location(item),
+                timestamps=self._normalize_timestamps(item, crawl_ts),
+                taxonomy=item.get("taxonomy", []),
                 
-                "enrichment": {
+                enrichment={
                     "price": price,
                     "relative_price_index": relative_price,
                     "risk_score": risk_score,
                     "risk_factors": list(found_cat),
                     "suspicious_keywords": list(set(found_kw)),
                     "has_suspicious_keywords": len(found_kw) > 0,
-                    "seller_items_today": seller_counts.get(item.get("user_id"), 0)
+                    "seller_items_today": seller_counts.get(seller_id, 0)
                 }
-            }
+            )
             
             enriched_items.append(enriched)
         
@@ -292,58 +476,108 @@ class WallapopEnricher:
         
         return result
     
-    def _normalize_timestamps(self, item: Dict) -> Dict:
-        """Normalize timestamps"""
-        def to_iso(ts):
-            if not ts:
-                return None
-            if isinstance(ts, str):
-                return ts
-            if isinstance(ts, (int, float)):
-                if ts > 10000000000:
-                    ts = ts / 1000
-                return datetime.utcfromtimestamp(ts).isoformat() + 'Z'
-            return None
-        
+    def _normalize_timestamps(self, item: Dict, crawl_ts: str) -> Dict:
+        """Normalize timestamps; crawl_ts is shared by the whole batch"""
         return {
-            "created_at": to_iso(item.get("created_at")),
-            "modified_at": to_iso(item.get("modified_at")),
-            "crawl_timestamp": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+            "created_at": _to_iso_any(item.get("created_at")),
+            "modified_at": _to_iso_any(item.get("modified_at")),
+            "crawl_timestamp": crawl_ts
         }
 
 
+_worker_state = {}
+
+
+def _init_worker(enricher: WallapopEnricher):
+    """Store the enricher (and its automaton) in the current process"""
+    _worker_state["enricher"] = enricher
+
+
+def _scan_text(text_lower: str) -> tuple:
+    """Match risk keywords in one item's text inside a pool worker"""
+    return _worker_state["enricher"]._match_keywords(text_lower)
+
+
 # ============================================================================
 # STEP 3: ELASTICSEARCH INGESTION
 # ============================================================================
 
+class _NdjsonBody:
+    """
+    Bulk request body streamed as NDJSON lines
+    
+    requests sends any iterable with chunked transfer encoding, so the
+    payload is never materialized as one string. Iterating again rebuilds
+    the lines, which lets urllib3 replay the body when it retries a POST.
+    """
+    
+    def __init__(self, items: List[Enriched], index_alias: str):
+        self.items = items
+        self.index_alias = index_alias
+    
+    def __iter__(self):
+        return _iter_ndjson(self.items, self.index_alias)
+
+
+def _iter_ndjson(items: List[Enriched], index_alias: str):
+    """Yield action and document lines of a bulk request as bytes"""
+    # The action line only varies by _id, so splice plain ids into a
+    # pre-serialized template instead of encoding a dict per item
+    action_prefix = b'{"index":{"_index":' + orjson.dumps(index_alias) + b',"_id":"'
+    action_suffix = b'"}}\n'
+    
+    for item in items:
+        # Action line
+        item_id = item.id
+        if isinstance(item_id, str) and item_id.isascii() and item_id.isalnum():
+            yield action_prefix + item_id.encode() + action_suffix
+        else:
+            action = {"index": {"_index": index_alias, "_id": item_id}}
+            yield orjson.dumps(action) + b"\n"
+        # Document line
+        yield orjson.dumps(item) + b"\n"
+
+
 class ElasticsearchIngester:
     """Handles bulk ingestion to Elasticsearch"""
     
     def __init__(self, es_host: str, index_alias: str):
         self.es_host = es_host
         self.index_alias = index_alias
-    
-    def bulk_ingest(self, items: List[Dict]) -> tuple:
-        """Ingest items using bulk API"""
-        if not items:
-            return 0, 0
         
-        # Build bulk request
-        bulk_body = []
-        for item in items:
-            # Action line
-            action = {"index": {"_index": self.index_alias, "_id": item.get("id")}}
-            bulk_body.append(json.dumps(action))
-            # Document line
-            bulk_body.append(json.dumps(item, ensure_ascii=False))
+        # Keep-alive session; bulk indexing by _id is idempotent, so POSTs
+        # are safe to retry on transient errors
+        self.session = requests.Session()
+        retries = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"]
+        )
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                              max_retries=retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    def bulk_ingest(self, items: List[Enriched]) -> tuple:
+        """Ingest items using bulk API, BATCH_SIZE documents per request"""
+        success = 0
+        errors = 0
         
-        bulk_data = '\n'.join(bulk_body) + '\n'
+        for i in range(0, len(items), BATCH_SIZE):
+            chunk_success, chunk_errors = self._bulk_chunk(items[i:i + BATCH_SIZE])
+            success += chunk_success
+            errors += chunk_errors
         
+        return success, errors
+    
+    def _bulk_chunk(self, items: List[Enriched]) -> tuple:
+        """Send one _bulk request for a chunk of items"""
         # Send to Elasticsearch
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.es_host}/_bulk",
-                data=bulk_data.encode('utf-8'),
+                data=_NdjsonBody(items, self.index_alias),
                 headers={"Content-Type": "application/x-ndjson"},
                 timeout=60
             )
@@ -373,15 +607,14 @@ class ElasticsearchIngester:
 # STEP 4: BACKUP TO DISK (Optional)
 # ============================================================================
 
-def save_backup(items: List[Dict], output_dir: str = OUTPUT_DIR):
+def save_backup(items: List[Enriched], output_dir: str = OUTPUT_DIR):
     """Save enriched data to daily JSON file"""
     os.makedirs(output_dir, exist_ok=True)
     today = datetime.now(timezone.utc).strftime("%Y%m%d")
     filename = os.path.join(output_dir, f"wallapop_motorbikes_{today}_enriched.json")
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        for item in items:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    with open(filename, 'wb', buffering=BACKUP_BUFFER_SIZE) as f:
+        f.writelines(orjson.dumps(item) + b"\n" for item in items)
     
     print(f"  ✓ Backup saved: {filename}")
 
@@ -403,31 +636,31 @@ def main():
     # Step 1: COLLECT
     print("\n[1/4] 📡 COLLECTING DATA FROM WALLAPOP...")
     collector = WallapopCollector()
-    items = collector.collect_all()
+    items = asyncio.run(collector.collect_all())
     
     if not items:
         print("✗ No items collected. Exiting.")
         return
     
-    # Step 1b: FILTER
+    # Step 1b: FILTER (fused with the enrichment pre-pass)
     print("\n[2/4] 🧹 FILTERING CLOTHING/ACCESSORIES...")
-    filtered_items, removed_count = collector.filter_clothing(items)
+    enricher = WallapopEnricher()
+    batch, removed_count = enricher.prepare_and_filter(items)
     print(f"  ✓ Removed: {removed_count} clothing items")
-    print(f"  ✓ Remaining: {len(filtered_items)} motorbikes")
+    print(f"  ✓ Remaining: {len(batch.records)} motorbikes")
     
-    if not filtered_items:
+    if not batch.records:
         print("✗ No motorbikes after filtering. Exiting.")
         return
     
     # Step 2: ENRICH
     print("\n[3/4] 🔧 ENRICHING DATA...")
-    enricher = WallapopEnricher()
-    enriched_items = enricher.enrich_all(filtered_items)
+    enriched_items = enricher.enrich_prepared(batch)
     print(f"  ✓ Enriched: {len(enriched_items)} items")
     
     # Calculate stats
     high_risk = sum(1 for item in enriched_items 
-                    if item["enrichment"]["risk_score"] >= 60)
+                    if item.enrichment["risk_score"] >= 60)
     print(f"  ⚠ High-risk items (score ≥60): {high_risk}")
     
     # Step 3: INGEST